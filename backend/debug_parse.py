@@ -1,17 +1,54 @@
 # backend/debug_parse.py
 
 
+import socket
+import struct
+
 from backend.parsers.net_parser import parse_packet
 from backend.parsers.mavlink_parser import parse_mavlink_stream, build_sample_mavlink_stream
-from scapy.all import raw
-from scapy.layers.l2 import Ether
-from scapy.layers.inet import IP, TCP
+
+_ETH = struct.Struct("!6s6sH")
+_IPV4 = struct.Struct("!BBHHHBBH4s4s")
+_TCP = struct.Struct("!HHLLBBHHH")
+_PSEUDO = struct.Struct("!4s4sBBH")
+
+
+def _checksum(data: bytes) -> int:
+    """Internet checksum（16 位反码和）"""
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def build_frame(src_ip: str, dst_ip: str, sport: int, dport: int, payload: bytes) -> bytes:
+    """
+    手工拼一帧 Ethernet/IPv4/TCP(SYN) + payload，字段取值和 Scapy 默认值一致，
+    省掉 import scapy 的几百毫秒。
+    """
+    src = socket.inet_aton(src_ip)
+    dst = socket.inet_aton(dst_ip)
+
+    tcp_len = _TCP.size + len(payload)
+    tcp = _TCP.pack(sport, dport, 0, 0, 5 << 4, 0x02, 8192, 0, 0)
+    pseudo = _PSEUDO.pack(src, dst, 0, socket.IPPROTO_TCP, tcp_len)
+    tcp_sum = _checksum(pseudo + tcp + payload)
+    tcp = _TCP.pack(sport, dport, 0, 0, 5 << 4, 0x02, 8192, tcp_sum, 0)
+
+    total_len = _IPV4.size + tcp_len
+    ip = _IPV4.pack(0x45, 0, total_len, 1, 0, 64, socket.IPPROTO_TCP, 0, src, dst)
+    ip = _IPV4.pack(0x45, 0, total_len, 1, 0, 64, socket.IPPROTO_TCP, _checksum(ip), src, dst)
+
+    eth = _ETH.pack(b"\xff" * 6, b"\x00" * 6, 0x0800)
+    return eth + ip + tcp + payload
+
 
 print(">>> debug_parse.py 开始执行了")
 def test_net():
     """测试主流网络协议解析：Ethernet/IP/TCP + payload"""
-    pkt = Ether() / IP(dst="1.2.3.4", src="5.6.7.8") / TCP(dport=80, sport=12345) / b"Hello World"
-    raw_bytes = raw(pkt)
+    raw_bytes = build_frame("5.6.7.8", "1.2.3.4", 12345, 80, b"Hello World")
 
     result = parse_packet(raw_bytes)
     print("=== NET PARSE ===")
@@ -1,19 +1,28 @@
 # backend/main.py
 import asyncio
-import json
+import ctypes
+import dataclasses
+import math
+import mmap
 import os
+import select
 import socket
 import struct
 import threading
-from typing import Optional, Set, Tuple, Any, Dict
+import time
+from collections import deque
+from typing import Optional, Set, Tuple, Any, Deque, Dict, Iterator
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+import orjson
 import uvicorn
 
+from mmsg import RecvBatch, SO_TIMESTAMPNS
 from parsers.dispatcher import dispatch_packet
+from parsers.mavlink_fastpath import extract_position, warm_up as warm_up_fastpath
 from parsers import PacketResult, LinkLayer
 
 # ================== 配置 ==================
@@ -32,12 +41,30 @@ CONTROLLER_PORT = 14557              # 控制端监听遥测/心跳的端口
 # RAW 抓包只关注控制流（发往 14556 的 UDP）
 UDP_PORT = PORT_A
 
+# 转发线程每次 recvmmsg / sendmmsg 的批大小；槽位按最大 UDP 报文分配，转发不截断
+FWD_MMSG_BATCH = 32
+FWD_SLOT_SIZE = 65535
+
 HTTP_HOST = "0.0.0.0"
 HTTP_PORT = 5900
 
 # 抓原始帧的网卡（容器里一般是 eth0，如果不对你可以改成其它）
 RAW_IFACE = "S--1C--25491"
 
+# 工作线程绑定的 CPU（最好是用 isolcpus 隔离出来的核），None 表示不绑
+RAW_CPU: Optional[int] = 2
+FWD_CTRL_CPU: Optional[int] = 3
+FWD_PX4_CPU: Optional[int] = 4
+# RAW 线程的 SCHED_FIFO 优先级，None 表示保持普通调度
+RAW_FIFO_PRIORITY: Optional[int] = 50
+# 启动时持有 /dev/cpu_dma_latency=0（整机禁止深度 C-state，不只是工作核），False 表示不动
+HOLD_CPU_DMA_LATENCY = True
+
+# RAW / 转发套接字的接收缓冲（默认只有 ~200KB，广播卡顿时容易丢包）
+SOCK_RCVBUF_BYTES = 8 * 1024 * 1024
+# RAW 套接字的 SO_BUSY_POLL（微秒），None 表示不开
+RAW_BUSY_POLL_US: Optional[int] = 50
+
 # frontend 目录：backend/../frontend
 FRONTEND_DIR = os.path.join(os.path.dirname(__file__), "..", "frontend")
 
@@ -46,15 +73,27 @@ FRONTEND_DIR = os.path.join(os.path.dirname(__file__), "..", "frontend")
 # 最近一条“有效控制变更”的包（用于 /api/latest、WebSocket 初次推送）
 LAST_PACKET: Optional[PacketResult] = None
 
-# 控制流去重：记住上一次的位置 (x, y, z) + 重复次数
-LAST_POS: Optional[tuple] = None
-LAST_POS_REPEAT: int = 0
+# 控制流去重：按 (sysid, compid) 分别记住上一次的位置 (x, y, z) + 重复次数
+# 还没收到过位置的流不在字典里
+LAST_POS: Dict[Tuple[int, int], Tuple[tuple, int]] = {}
+
 
 LOCK = threading.Lock()
 
 connected_clients: Set[WebSocket] = set()
 MAIN_LOOP: Optional[asyncio.AbstractEventLoop] = None
 
+# RAW 线程 -> 事件循环 的广播队列（单生产者 / 单消费者，满了丢最旧的）
+BROADCAST_QUEUE: Deque[bytes] = deque(maxlen=1024)
+BROADCAST_EVENT: Optional[asyncio.Event] = None
+_BROADCAST_WAKEUP_PENDING = False
+_BROADCAST_TASK: Optional[asyncio.Task] = None
+
+# 每条流 (src_ip, src_port, dst_ip, dst_port) 上一次 pkt.to_dict() 的结果和对应的 LinkLayer，
+# 同一条流的 link / network 基本不变，只需要重建 application。只由 RAW 线程读写
+FLOW_DICT_CACHE: Dict[Tuple[str, int, str, int], Tuple[LinkLayer, Dict[str, Any]]] = {}
+FLOW_DICT_CACHE_MAX = 256
+
 
 # ================== 前端 override JSON 模型 ==================
 
@@ -97,6 +136,12 @@ async def index():
 
 # -------------- 帮助函数：解析以太网 + IPv4 + UDP --------------
 
+# 预编译的首部格式，避免每帧重新解析格式串
+_ETH = struct.Struct("!6s6sH")            # dst_mac, src_mac, eth_type
+_IP = struct.Struct("!BBHHHBBH4s4s")      # IPv4 固定 20 字节首部
+_UDP = struct.Struct("!HHHH")             # src_port, dst_port, len, checksum
+
+
 def mac_to_str(b: bytes) -> str:
     return ":".join(f"{x:02x}" for x in b)
 
@@ -107,7 +152,7 @@ def ip_to_str(b: bytes) -> str:
 
 def parse_ethernet_ipv4_udp(
     frame: bytes,
-) -> Optional[Tuple[LinkLayer, str, int, str, int, bytes]]:
+) -> Optional[Tuple[LinkLayer, str, int, str, int, memoryview]]:
     """
     解析一帧以太网数据：
       - Ethernet 头（14 字节）
@@ -115,22 +160,17 @@ def parse_ethernet_ipv4_udp(
       - UDP 头（8 字节）
     返回：
       (link_layer, src_ip, src_port, dst_ip, dst_port, udp_payload)
+    udp_payload 是指向 frame 的 memoryview，不做拷贝；需要长期保存时自己 bytes() 一下。
     如果不是 IPv4+UDP 或长度不够，则返回 None。
     """
-    if len(frame) < 14:
+    frame_len = len(frame)
+    if frame_len < 14:
         return None
 
+    mv = memoryview(frame)
+
     # Ethernet 头：dst_mac(6) + src_mac(6) + eth_type(2)
-    dst_mac_raw, src_mac_raw, eth_type = struct.unpack("!6s6sH", frame[:14])
-    dst_mac = mac_to_str(dst_mac_raw)
-    src_mac = mac_to_str(src_mac_raw)
-    link = LinkLayer(
-        protocol="Ethernet",
-        src_mac=src_mac,
-        dst_mac=dst_mac,
-        eth_type=f"0x{eth_type:04x}",
-        raw_hex=frame[:14].hex(),
-    )
+    dst_mac_raw, src_mac_raw, eth_type = _ETH.unpack_from(mv, 0)
 
     # 只处理 IPv4
     if eth_type != 0x0800:
@@ -138,118 +178,423 @@ def parse_ethernet_ipv4_udp(
 
     # IP 头起始位置
     ip_start = 14
-    if len(frame) < ip_start + 20:
+    if frame_len < ip_start + 20:
         return None
 
     # IP 首部
-    ip_header = frame[ip_start: ip_start + 20]
     ver_ihl, tos, total_len, ident, flags_frag, ttl, proto, checksum, \
-        src_ip_raw, dst_ip_raw = struct.unpack("!BBHHHBBH4s4s", ip_header)
+        src_ip_raw, dst_ip_raw = _IP.unpack_from(mv, ip_start)
 
     ihl = (ver_ihl & 0x0F) * 4  # IP 头长度 = IHL * 4
-    if len(frame) < ip_start + ihl:
+    if frame_len < ip_start + ihl:
         return None
 
-    src_ip = ip_to_str(src_ip_raw)
-    dst_ip = ip_to_str(dst_ip_raw)
-
     # 只处理 UDP（proto=17）
     if proto != 17:
         return None
 
     udp_start = ip_start + ihl
-    if len(frame) < udp_start + 8:
+    if frame_len < udp_start + 8:
         return None
 
-    udp_header = frame[udp_start: udp_start + 8]
-    src_port, dst_port, udp_len, udp_checksum = struct.unpack("!HHHH", udp_header)
+    src_port, dst_port, udp_len, udp_checksum = _UDP.unpack_from(mv, udp_start)
 
     # UDP payload 起始位置
     payload_start = udp_start + 8
-    if len(frame) < payload_start:
-        return None
 
-    udp_payload = frame[payload_start:]
+    link = LinkLayer(
+        protocol="Ethernet",
+        src_mac=mac_to_str(src_mac_raw),
+        dst_mac=mac_to_str(dst_mac_raw),
+        eth_type=f"0x{eth_type:04x}",
+        raw_hex=mv[:14].hex(),
+    )
 
-    return link, src_ip, src_port, dst_ip, dst_port, udp_payload
+    return (
+        link,
+        ip_to_str(src_ip_raw),
+        src_port,
+        ip_to_str(dst_ip_raw),
+        dst_port,
+        mv[payload_start:],
+    )
 
 
 # -------------- WebSocket 广播辅助 --------------
 
-async def broadcast_message(msg: dict):
+async def broadcast_bytes(data: bytes):
+    """
+    广播已经序列化好的 JSON（UTF-8 bytes，走二进制帧，省掉 str -> utf8 编码）。
+    只序列化一次，同一份 payload 发给所有客户端。
+    RAW 线程 enqueue_broadcast 进来的消息由 broadcast_drain_task 合并后走这里。
+    """
+    clients = list(connected_clients)
+    if not clients:
+        return
+
+    # 所有客户端并发发送同一份 bytes，慢客户端不会拖住其它客户端
+    results = await asyncio.gather(
+        *(ws.send_bytes(data) for ws in clients),
+        return_exceptions=True,
+    )
+
+    for ws, res in zip(clients, results):
+        if isinstance(res, Exception):
+            connected_clients.discard(ws)
+
+
+# -------------- type="none" 消息模板 --------------
+
+# 位置没变时推给前端的 type="none" 消息预先拼成 JSON，计数和 x/y/z 是固定宽度的槽位，
+# 每次只把数字右对齐写进去（左边补空格，JSON 允许）。只由 RAW 线程在 LOCK 里改写。
+_NONE_CNT_WIDTH = 10
+_NONE_POS_WIDTH = 16
+
+
+def _build_none_template() -> Tuple[bytearray, list]:
+    template = bytearray()
+    slots = []  # [(offset, width), ...]：repeat_cnt, x, y, z
+    for chunk, width in (
+        (b'{"type":"none","packet":{"meta":{"repeat_cnt":', _NONE_CNT_WIDTH),
+        (b',"position":{"x":', _NONE_POS_WIDTH),
+        (b',"y":', _NONE_POS_WIDTH),
+        (b',"z":', _NONE_POS_WIDTH),
+    ):
+        template += chunk
+        slots.append((len(template), width))
+        template += b" " * width
+    template += b"}}}}"
+    return template, slots
+
+
+_NONE_TEMPLATE, _NONE_SLOTS = _build_none_template()
+
+
+def render_none_message(repeat_cnt: int, xyz: tuple) -> bytes:
+    """
+    把 repeat_cnt / x,y,z 写进 _NONE_TEMPLATE 的槽位，返回一份拷贝。
+    数字放不下（或者是 NaN/inf）时退回 orjson 正常序列化。
+    """
+    x, y, z = xyz
+    values = (
+        b"%*d" % (_NONE_CNT_WIDTH, repeat_cnt),
+        b"%*.3f" % (_NONE_POS_WIDTH, x),
+        b"%*.3f" % (_NONE_POS_WIDTH, y),
+        b"%*.3f" % (_NONE_POS_WIDTH, z),
+    )
+    if not (math.isfinite(x) and math.isfinite(y) and math.isfinite(z)) or \
+            any(len(v) != width for v, (_, width) in zip(values, _NONE_SLOTS)):
+        return orjson.dumps({
+            "type": "none",
+            "packet": {
+                "meta": {
+                    "repeat_cnt": repeat_cnt,
+                    "position": {"x": x, "y": y, "z": z},
+                },
+            },
+        })
+
+    for v, (off, width) in zip(values, _NONE_SLOTS):
+        _NONE_TEMPLATE[off:off + width] = v
+    return bytes(_NONE_TEMPLATE)
+
+
+# -------------- RAW 线程 -> 事件循环 --------------
+
+def enqueue_broadcast(data: bytes, loop: asyncio.AbstractEventLoop):
+    """
+    RAW 线程调用：把序列化好的消息放进 BROADCAST_QUEUE。
+    只有在 broadcast_drain_task 没有待处理的唤醒时才 call_soon_threadsafe 一次，
+    不再每个包一个 run_coroutine_threadsafe / Future。
+    """
+    global _BROADCAST_WAKEUP_PENDING
+    BROADCAST_QUEUE.append(data)
+    # 先入队再看标志：drain 任务是先清标志再取队列，所以这条消息不会被漏掉
+    if not _BROADCAST_WAKEUP_PENDING:
+        _BROADCAST_WAKEUP_PENDING = True
+        loop.call_soon_threadsafe(BROADCAST_EVENT.set)
+
+
+async def broadcast_drain_task():
     """
-    通用广播：直接发送传入的 msg（已经包含 type 等字段）
+    事件循环里唯一的消费者：一次取走队列里所有消息，
+    多条时拼成一个 JSON 数组，用一次 send 发给每个客户端。
     """
-    if not connected_clients:
+    global _BROADCAST_WAKEUP_PENDING
+    while True:
+        await BROADCAST_EVENT.wait()
+        BROADCAST_EVENT.clear()
+        _BROADCAST_WAKEUP_PENDING = False
+
+        items = []
+        while BROADCAST_QUEUE:
+            items.append(BROADCAST_QUEUE.popleft())
+        if not items:
+            continue
+
+        if len(items) == 1:
+            await broadcast_bytes(items[0])
+        else:
+            await broadcast_bytes(b"[" + b",".join(items) + b"]")
+
+
+# -------------- 线程绑核 / 实时调度 --------------
+
+# /dev/cpu_dma_latency 写 0 后只要文件不关就一直生效（禁止深度 C-state）
+_CPU_DMA_LATENCY_FD: Optional[int] = None
+
+
+def hold_cpu_dma_latency():
+    """打开 /dev/cpu_dma_latency 写入 0，进程存活期间一直持有"""
+    global _CPU_DMA_LATENCY_FD
+    if _CPU_DMA_LATENCY_FD is not None:
         return
+    try:
+        fd = os.open("/dev/cpu_dma_latency", os.O_WRONLY)
+        os.write(fd, struct.pack("i", 0))
+    except OSError as e:
+        print(f"[APP] cannot hold /dev/cpu_dma_latency: {e}")
+        return
+    _CPU_DMA_LATENCY_FD = fd
 
-    text = json.dumps(msg, ensure_ascii=False)
 
-    dead_clients = []
-    for ws in list(connected_clients):
+def pin_current_thread(tag: str, cpu: Optional[int], fifo_priority: Optional[int] = None):
+    """
+    把当前线程绑到 cpu 上，可选切到 SCHED_FIFO。
+    没权限 / 没有这个核时只打印一下，线程照常跑。
+    """
+    if cpu is not None:
         try:
-            await ws.send_text(text)
-        except Exception:
-            dead_clients.append(ws)
+            os.sched_setaffinity(0, {cpu})
+        except OSError as e:
+            print(f"[{tag}] cannot pin to CPU {cpu}: {e}")
 
-    for ws in dead_clients:
-        connected_clients.discard(ws)
+    if fifo_priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(fifo_priority))
+        except OSError as e:
+            print(f"[{tag}] cannot switch to SCHED_FIFO: {e}")
+
+
+# -------------- 套接字参数 --------------
 
+SO_BUSY_POLL = 46  # asm-generic/socket.h（socket 模块不一定导出）
 
-async def broadcast_packet(pkt_dict: dict):
+
+def tune_socket(
+    sock: socket.socket,
+    tag: str,
+    busy_poll_us: Optional[int] = None,
+    timestamps: bool = False,
+):
     """
-    兼容原来的接口：把包包装成 {"type": "packet", "packet": ...} 再发
+    加大接收缓冲，可选打开 SO_BUSY_POLL / SO_TIMESTAMPNS。
+    有 CAP_NET_ADMIN 时用 SO_RCVBUFFORCE 绕过 net.core.rmem_max 上限；失败只打印。
     """
-    msg = {
-        "type": "packet",
-        "packet": pkt_dict,
-    }
-    await broadcast_message(msg)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUFFORCE, SOCK_RCVBUF_BYTES)
+    except (OSError, AttributeError):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_RCVBUF_BYTES)
+        except OSError as e:
+            print(f"[{tag}] cannot set SO_RCVBUF: {e}")
+
+    if busy_poll_us is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, busy_poll_us)
+        except OSError as e:
+            print(f"[{tag}] cannot set SO_BUSY_POLL: {e}")
 
+    if timestamps:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        except OSError as e:
+            print(f"[{tag}] cannot set SO_TIMESTAMPNS: {e}")
+
+
+# -------------- RAW 接收环：PACKET_MMAP (TPACKET_V3) --------------
+
+# linux/if_ether.h、linux/if_packet.h 里的常量（socket 模块没有导出）
+ETH_P_IP = 0x0800
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# 环形缓冲参数：64 个 4MB 的 block，block 未填满时 50ms 后也会交给用户态
+RAW_RING_BLOCK_SIZE = 1 << 22
+RAW_RING_BLOCK_NR = 64
+RAW_RING_FRAME_SIZE = 2048
+RAW_RING_RETIRE_TOV_MS = 50
+
+# 退回 recvmmsg 时每次系统调用最多取多少帧
+RAW_MMSG_BATCH = 32
+
+# struct tpacket_req3
+_TPACKET_REQ3 = struct.Struct("=IIIIIII")
+# struct tpacket_block_desc：version, offset_to_priv 之后是 tpacket_hdr_v1
+# 这里只取 block_status, num_pkts, offset_to_first_pkt
+_BLOCK_DESC_OFF = 8
+_BLOCK_DESC = struct.Struct("=III")
+_BLOCK_STATUS = struct.Struct("=I")
+# struct tpacket3_hdr：tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len,
+#                      tp_status, tp_mac, tp_net
+_TP3_HDR = struct.Struct("=IIIIIIHH")
+
+
+def setup_rx_ring(sock: socket.socket) -> mmap.mmap:
+    """
+    给 AF_PACKET 套接字挂上 TPACKET_V3 接收环并 mmap 出来。
+    内核把一批帧直接写进共享内存，用户态按 block 遍历，不再每帧 recvfrom。
+    """
+    sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+    frame_nr = RAW_RING_BLOCK_SIZE * RAW_RING_BLOCK_NR // RAW_RING_FRAME_SIZE
+    req = _TPACKET_REQ3.pack(
+        RAW_RING_BLOCK_SIZE,
+        RAW_RING_BLOCK_NR,
+        RAW_RING_FRAME_SIZE,
+        frame_nr,
+        RAW_RING_RETIRE_TOV_MS,
+        0,  # tp_sizeof_priv
+        0,  # tp_feature_req_word
+    )
+    sock.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+    return mmap.mmap(
+        sock.fileno(),
+        RAW_RING_BLOCK_SIZE * RAW_RING_BLOCK_NR,
+        mmap.MAP_SHARED,
+        mmap.PROT_READ | mmap.PROT_WRITE,
+    )
 
-# -------------- 小工具：从 fields 里提取 x / y / z --------------
 
-def extract_xyz_from_app(app) -> Optional[tuple]:
+def iter_ring_frames(
+    sock: socket.socket, ring: mmap.mmap
+) -> Iterator[Tuple[memoryview, Optional[int]]]:
     """
-    从 ApplicationLayer 里取出 x, y, z（只处理位置/控制相关的 MAVLink 消息）。
-    取不到就返回 None。
+    依次产出环里的每一帧 (memoryview, 内核接收时间 ns)，memoryview 指向共享内存。
+    一个 block 处理完才归还给内核，所以产出的 memoryview 只在下一次迭代前有效。
     """
-    msg_name = app.msg_name or ""
-    fields_all = app.fields or {}
+    poller = select.poll()
+    poller.register(sock.fileno(), select.POLLIN | select.POLLERR)
 
-    # 只关心这些消息，其他类型直接丢掉
-    if msg_name not in (
-        "SET_POSITION_TARGET_LOCAL_NED",
-        "POSITION_TARGET_LOCAL_NED",
-        "LOCAL_POSITION_NED",
-        "GLOBAL_POSITION_INT",
-    ):
-        return None
+    mv = memoryview(ring)
+    block_idx = 0
+
+    while True:
+        blk_off = block_idx * RAW_RING_BLOCK_SIZE
+        status, num_pkts, pkt_off = _BLOCK_DESC.unpack_from(ring, blk_off + _BLOCK_DESC_OFF)
 
-    # 如果有 payload 就优先用 payload
-    if isinstance(fields_all, dict) and "payload" in fields_all \
-            and isinstance(fields_all["payload"], dict):
-        f = fields_all["payload"]
-    else:
-        f = fields_all
-
-    def getf(name: str):
-        v = f.get(name)
-        if v is None:
-            return None
+        if not status & TP_STATUS_USER:
+            # 当前 block 还在内核手里，等它交出来
+            poller.poll()
+            continue
+
+        pkt_off += blk_off
+        for _ in range(num_pkts):
+            next_off, sec, nsec, snaplen, _len, _st, mac_off, _net_off = \
+                _TP3_HDR.unpack_from(ring, pkt_off)
+            start = pkt_off + mac_off
+            yield mv[start:start + snaplen], sec * 1_000_000_000 + nsec
+            pkt_off += next_off
+
+        # 归还 block
+        _BLOCK_STATUS.pack_into(ring, blk_off + _BLOCK_DESC_OFF, TP_STATUS_KERNEL)
+        block_idx = (block_idx + 1) % RAW_RING_BLOCK_NR
+
+
+def iter_mmsg_frames(sock: socket.socket) -> Iterator[Tuple[memoryview, Optional[int]]]:
+    """
+    环不可用时的退路：recvmmsg 一次最多取 RAW_MMSG_BATCH 帧。
+    产出 (memoryview, SCM_TIMESTAMPNS)，memoryview 指向预分配的槽位，下一批到来前有效。
+    """
+    batch = RecvBatch(RAW_MMSG_BATCH, RAW_RING_FRAME_SIZE, with_timestamp=True)
+    while True:
         try:
-            return round(float(v), 3)  # 保留 3 位小数避免浮点抖动
-        except Exception:
-            return None
+            n = batch.recv(sock)
+        except OSError as e:
+            print(f"[RAW] recv error: {e}")
+            continue
+        for i in range(n):
+            yield batch.frame(i), batch.timestamp_ns(i)
 
-    x = getf("x")
-    y = getf("y")
-    z = getf("z")
 
-    if x is None or y is None or z is None:
-        return None
+# -------------- RAW 内核过滤：classic BPF --------------
+
+SO_ATTACH_FILTER = getattr(socket, "SO_ATTACH_FILTER", 26)
+
+# linux/filter.h 里用到的几条指令
+_BPF_LDH_ABS = 0x28   # ldh [k]
+_BPF_LDB_ABS = 0x30   # ldb [k]
+_BPF_LD_ABS = 0x20    # ld  [k]
+_BPF_LDH_IND = 0x48   # ldh [x + k]
+_BPF_LDXB_MSH = 0xB1  # ldxb 4*([k]&0xf)
+_BPF_JEQ = 0x15       # jeq #k, jt, jf
+_BPF_JSET = 0x45      # jset #k, jt, jf
+_BPF_RET = 0x06       # ret #k
 
-    return (x, y, z)
+# struct sock_filter { __u16 code; __u8 jt; __u8 jf; __u32 k; }
+_SOCK_FILTER = struct.Struct("=HBBI")
+
+
+def build_udp_filter(dst_port: int, src_ip: Optional[str]) -> list:
+    """
+    生成等价于 tcpdump 'ip and udp and dst port <dst_port> and src host <src_ip>'
+    的 cBPF 程序（src_ip 为 None 时不限制来源）。
+    返回 [(code, jt, jf, k), ...]；跳转目标 None 表示“丢弃”。
+    """
+    prog = [
+        (_BPF_LDH_ABS, 0, 0, 12),               # eth_type
+        (_BPF_JEQ, 0, None, ETH_P_IP),
+        (_BPF_LDB_ABS, 0, 0, 23),               # ip proto
+        (_BPF_JEQ, 0, None, 17),
+        (_BPF_LDH_ABS, 0, 0, 20),               # 分片偏移不为 0 的没有 UDP 头
+        (_BPF_JSET, None, 0, 0x1FFF),
+        (_BPF_LDXB_MSH, 0, 0, 14),              # x = IP 头长度
+        (_BPF_LDH_IND, 0, 0, 16),               # udp dst port
+        (_BPF_JEQ, 0, None, dst_port),
+    ]
+    if src_ip is not None:
+        prog += [
+            (_BPF_LD_ABS, 0, 0, 26),            # ip src
+            (_BPF_JEQ, 0, None, struct.unpack("!I", socket.inet_aton(src_ip))[0]),
+        ]
+    prog += [
+        (_BPF_RET, 0, 0, 0x40000),              # 接收整帧
+        (_BPF_RET, 0, 0, 0),                    # 丢弃
+    ]
+
+    reject = len(prog) - 1
+    return [
+        (
+            code,
+            reject - i - 1 if jt is None else jt,
+            reject - i - 1 if jf is None else jf,
+            k,
+        )
+        for i, (code, jt, jf, k) in enumerate(prog)
+    ]
+
+
+def attach_udp_filter(sock: socket.socket, dst_port: int, src_ip: Optional[str]) -> bool:
+    """
+    把 build_udp_filter 的程序挂到 sock 上（重复调用会替换旧过滤器）。
+    成功返回 True；失败时打印原因并返回 False，调用方需要自己在用户态过滤。
+    """
+    try:
+        # src_ip 不是合法的 IPv4 地址（比如输成了主机名）时 inet_aton 也会抛 OSError
+        prog = build_udp_filter(dst_port, src_ip)
+        insns = ctypes.create_string_buffer(
+            b"".join(_SOCK_FILTER.pack(*insn) for insn in prog)
+        )
+        # struct sock_fprog { unsigned short len; struct sock_filter *filter; }
+        fprog = struct.pack("HP", len(prog), ctypes.addressof(insns))
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+    except OSError as e:
+        print(f"[RAW] attach BPF filter failed: {e}")
+        return False
+    return True
 
 
 # -------------- RAW worker：只解析“控制端 -> PX4”控制流 --------------
@@ -257,127 +602,172 @@ def extract_xyz_from_app(app) -> Optional[tuple]:
 def raw_worker(loop: asyncio.AbstractEventLoop):
     """
     AF_PACKET 原始抓包：
+      - 内核里挂 BPF 过滤器，只放行 CONTROLLER_IP -> UDP_PORT 的 UDP
+      - 优先用 TPACKET_V3 接收环，开不起来（老内核 / 内存不够）就退回 recvmmsg 批量收
+      - 每一帧交给 handle_raw_frame 处理
+    """
+    # numba 第一次调用时才编译，先在普通调度下编译好，别在 SCHED_FIFO 下卡住头几帧
+    warm_up_fastpath()
+    pin_current_thread("RAW", RAW_CPU, RAW_FIFO_PRIORITY)
+
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_IP))
+    # 接收环自带 tp_sec/tp_nsec，SO_TIMESTAMPNS 只对 recvmmsg 退路有用
+    tune_socket(sock, "RAW", busy_poll_us=RAW_BUSY_POLL_US, timestamps=True)
+
+    # 先挂过滤器再 bind，不让无关帧进入接收队列。
+    # CONTROLLER_IP 只在启动前输入一次，过滤器挂上后不再变
+    kernel_filtered = attach_udp_filter(sock, UDP_PORT, CONTROLLER_IP)
+
+    try:
+        ring = setup_rx_ring(sock)
+        frames: Iterator = iter_ring_frames(sock, ring)
+        mode = "TPACKET_V3 ring"
+    except OSError as e:
+        print(f"[RAW] rx ring unavailable ({e}), falling back to recvmmsg")
+        frames = iter_mmsg_frames(sock)
+        mode = "recvmmsg"
+
+    sock.bind((RAW_IFACE, 0))
+    print(
+        f"[RAW] listening on iface={RAW_IFACE} ({mode}), dst UDP port={UDP_PORT}, "
+        f"kernel filter={'on' if kernel_filtered else 'off'}"
+    )
+
+    for frame, received_ns in frames:
+        handle_raw_frame(frame, loop, kernel_filtered, received_ns)
+
+
+def handle_raw_frame(
+    frame,
+    loop: asyncio.AbstractEventLoop,
+    kernel_filtered: bool = False,
+    received_ns: Optional[int] = None,
+):
+    """
+    处理一帧原始以太网数据：
       - 只处理 UDP，dst_port == UDP_PORT(14556)
       - 只关心 src_ip == CONTROLLER_IP（控制端发出的控制流）
-      - 只对带 x,y,z 的位置控制消息做处理：
+      - 只对带 x,y,z 的位置控制消息做处理（按 sysid/compid 分别去重）：
           * 如果新包 (x,y,z) 和前一条一样，发送一条 type="none" 给前端
           * 如果 (x,y,z) 变化了，就推一条 type="packet"，并在 meta.repeat_since_last 里
             带上“上一条位置重复了多少次”
       - 不解析 / 不推无人机回传（PX4 -> 控制端）的数据
+    kernel_filtered=True 表示端口 / 来源已经由 BPF 过滤器在内核里筛过。
+    frame 可能指向接收环的共享内存，函数返回后就不能再引用它。
+    received_ns 是内核给的接收时间，写进 meta.received_at（秒）；没有时用当前时间。
     """
-    global LAST_PACKET, LAST_POS, LAST_POS_REPEAT
+    global LAST_PACKET
 
-    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(0x0003))
-    sock.bind((RAW_IFACE, 0))
-    print(f"[RAW] listening on iface={RAW_IFACE}, dst UDP port={UDP_PORT}")
-
-    while True:
-        try:
-            frame, addr = sock.recvfrom(65535)
-        except Exception as e:
-            print(f"[RAW] recv error: {e}")
-            continue
-
-        parsed = parse_ethernet_ipv4_udp(frame)
-        if parsed is None:
-            continue
+    parsed = parse_ethernet_ipv4_udp(frame)
+    if parsed is None:
+        return
 
-        link, src_ip, src_port, dst_ip, dst_port, payload = parsed
+    link, src_ip, src_port, dst_ip, dst_port, payload = parsed
 
+    if not kernel_filtered:
         # 只看发往 14556 的 UDP
         if dst_port != UDP_PORT:
-            continue
+            return
 
         # 只关心“控制器 → 中间端 → PX4”的流，不要无人机回传
         if CONTROLLER_IP is not None and src_ip != CONTROLLER_IP:
-            continue
+            return
 
-        try:
-            pkt = dispatch_packet(
-                payload,
-                src_ip=src_ip,
-                src_port=src_port,
-                dst_ip=dst_ip,
-                dst_port=dst_port,
-                transport="UDP",
-                link=link,
-            )
-        except Exception as e:
-            print(f"[RAW] dispatch error: {e}")
-            continue
+    # 先用快速扫描拿 x,y,z：非位置消息（心跳、TIMESYNC 等）、非 MAVLink、CRC 错的
+    # 直接丢掉，不用走 pymavlink / 构造 ApplicationLayer
+    pos = extract_position(payload)
+    if pos is None:
+        return
+    sysid, compid, xyz = pos
+    stream = (sysid, compid)
 
-        app = pkt.application
+    with LOCK:
+        last = LAST_POS.get(stream)
+        if last is not None and last[0] == xyz:
+            # 位置没变：重复计数 +1，并发 type="none" 给前端。
+            # 悬停时绝大多数包都走这里，只改模板里的计数 / 位置，不构造 PacketResult
+            repeat = last[1] + 1
+            LAST_POS[stream] = (xyz, repeat)
+            if not connected_clients:
+                return
+
+            enqueue_broadcast(render_none_message(repeat, xyz), loop)
+            # 不再推“正常”数据包
+            return
+
+    # 第一条位置包，或者位置发生变化：这时才做完整解析
+    try:
+        pkt = dispatch_packet(
+            payload,
+            src_ip=src_ip,
+            src_port=src_port,
+            dst_ip=dst_ip,
+            dst_port=dst_port,
+            transport="UDP",
+            link=link,
+        )
+    except Exception as e:
+        print(f"[RAW] dispatch error: {e}")
+        return
 
-        # 只对 MAVLink 包做进一步处理
-        if app.protocol != "MAVLink" or not app.is_mavlink:
-            continue
+    with LOCK:
+        last = LAST_POS.get(stream)
+        prev_repeat = last[1] if last is not None else 0
+        LAST_POS[stream] = (xyz, 0)
+
+        # 记录最近一条“有效位置变更”
+        LAST_PACKET = pkt
+
+    # 把这条“位置变化”的包推到前端（正常的 type="packet"）
+    pkt_dict = packet_to_dict(pkt, (src_ip, src_port, dst_ip, dst_port))
+    meta: Dict[str, Any] = pkt_dict["meta"]
+    meta["repeat_since_last"] = prev_repeat  # 上一个位置重复了多少次
+    meta["received_at"] = (received_ns if received_ns is not None else time.time_ns()) / 1e9
+    meta["position"] = {
+        "x": xyz[0],
+        "y": xyz[1],
+        "z": xyz[2],
+    }
 
-        # 只关心带位置的消息
-        xyz = extract_xyz_from_app(app)
-        if xyz is None:
-            # 非位置消息（心跳、TIMESYNC 等）可以暂时打印一下类型：
-            # print(f"[RAW] non-pos MAVLink msg: {app.msg_name}")
-            continue
+    enqueue_broadcast(orjson.dumps({"type": "packet", "packet": pkt_dict}), loop)
 
-        # 不再打印 xyz 日志
-
-        with LOCK:
-            prev_repeat = LAST_POS_REPEAT
-
-            if LAST_POS is None:
-                # 第一条位置包
-                LAST_POS = xyz
-                LAST_POS_REPEAT = 0
-
-                # 记录最近一条“有效位置变更”
-                LAST_PACKET = pkt
-
-            elif xyz == LAST_POS:
-                # 位置没变：重复计数 +1，并发 type="none" 给前端
-                LAST_POS_REPEAT += 1
-
-                pkt_dict = {
-                    "meta": {
-                        "repeat_cnt": LAST_POS_REPEAT,
-                        "position": {
-                            "x": LAST_POS[0],
-                            "y": LAST_POS[1],
-                            "z": LAST_POS[2],
-                        },
-                    }
-                }
-                msg = {
-                    "type": "none",
-                    "packet": pkt_dict,
-                }
-
-                asyncio.run_coroutine_threadsafe(
-                    broadcast_message(msg), loop
-                )
-                # 不再推“正常”数据包
-                continue
-
-            else:
-                # 位置发生变化
-                LAST_POS = xyz
-                LAST_POS_REPEAT = 0
-
-                # 记录最近一条“有效位置变更”
-                LAST_PACKET = pkt
-
-        # 把这条“位置变化”的包推到前端（正常的 type="packet"）
-        pkt_dict = pkt.to_dict()
-        meta: Dict[str, Any] = pkt_dict.setdefault("meta", {})
-        meta["repeat_since_last"] = prev_repeat  # 上一个位置重复了多少次
-        meta["position"] = {
-            "x": xyz[0],
-            "y": xyz[1],
-            "z": xyz[2],
-        }
-
-        asyncio.run_coroutine_threadsafe(
-            broadcast_packet(pkt_dict), loop
-        )
+
+def packet_to_dict(pkt: PacketResult, flow: Tuple[str, int, str, int]) -> Dict[str, Any]:
+    """
+    等价于 pkt.to_dict()，但同一条流上复用缓存的 link / network 子字典，
+    只重新生成 application / meta（都取自当前 pkt）。返回的是浅拷贝，调用方可以直接改 meta。
+    application / meta 不是 dataclass（或 dict）时没法单独生成，直接走 pkt.to_dict()。
+    """
+    cached = FLOW_DICT_CACHE.get(flow)
+    if cached is not None and cached[0] == pkt.link:
+        application = _subtree_to_dict(pkt.application)
+        meta = _subtree_to_dict(getattr(pkt, "meta", None))
+        if application is not None and meta is not None:
+            pkt_dict = dict(cached[1])
+            pkt_dict["application"] = application
+            pkt_dict["meta"] = meta
+            return pkt_dict
+
+    # 新的流、MAC / 以太类型变了，或者子树没法单独生成：完整生成一次
+    base = pkt.to_dict()
+    if len(FLOW_DICT_CACHE) >= FLOW_DICT_CACHE_MAX:
+        FLOW_DICT_CACHE.clear()
+    FLOW_DICT_CACHE[flow] = (pkt.link, base)
+
+    pkt_dict = dict(base)
+    pkt_dict["meta"] = dict(base.get("meta") or {})
+    return pkt_dict
+
+
+def _subtree_to_dict(obj) -> Optional[Dict[str, Any]]:
+    """按 to_dict() 的方式（dataclasses.asdict）生成一个子树；None 当作空 dict，其它类型返回 None"""
+    if obj is None:
+        return {}
+    if isinstance(obj, dict):
+        return dict(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    return None
 
 
 # -------------- 转发 1：控制端 -> PX4 --------------
@@ -387,7 +777,10 @@ def controller_forward_worker():
     控制流：
       控制器(CONTROLLER_IP:任意端口) -> 中间端:14556 -> PX4(TARGET_IP:14556)
     """
+    pin_current_thread("FWD", FWD_CTRL_CPU)
+
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tune_socket(sock, "FWD")
     sock.bind((LISTEN_HOST, PORT_A))
 
     print(
@@ -395,21 +788,23 @@ def controller_forward_worker():
         f"forwarding to PX4 {TARGET_IP}:{TARGET_PORT}"
     )
 
+    batch = RecvBatch(FWD_MMSG_BATCH, FWD_SLOT_SIZE, with_addr=True)
+
     while True:
         try:
-            data, addr = sock.recvfrom(65535)
+            n = batch.recv(sock)
         except Exception as e:
             print(f"[FWD] CTRL recv error: {e}")
             continue
 
-        src_ip, src_port = addr
-
         # 如果来源 IP 不是控制端，直接丢弃
-        if CONTROLLER_IP is not None and src_ip != CONTROLLER_IP:
-            continue
+        if CONTROLLER_IP is None:
+            keep = range(n)
+        else:
+            keep = [i for i in range(n) if batch.src_ip(i) == CONTROLLER_IP]
 
         try:
-            sock.sendto(data, (TARGET_IP, TARGET_PORT))
+            batch.send_to(sock, keep, (TARGET_IP, TARGET_PORT))
         except Exception as e:
             print(f"[FWD] CTRL send error: {e}")
 
@@ -424,7 +819,10 @@ def px4_to_controller_forward_worker():
     不再强制检查 src_ip == TARGET_IP：
       - 只要有东西打到中间端的 14557，就原样转发给控制端 14557。
     """
+    pin_current_thread("FWD", FWD_PX4_CPU)
+
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tune_socket(sock, "FWD")
     sock.bind((LISTEN_HOST, PORT_B))
 
     print(
@@ -433,20 +831,19 @@ def px4_to_controller_forward_worker():
     )
 
     learned_px4_ip: Optional[str] = None
+    batch = RecvBatch(FWD_MMSG_BATCH, FWD_SLOT_SIZE, with_addr=True)
 
     while True:
         try:
-            data, addr = sock.recvfrom(65535)
+            n = batch.recv(sock)
         except Exception as e:
             print(f"[FWD] PX4 recv error: {e}")
             continue
 
-        src_ip, src_port = addr
-
         # 第一次收到包时记一下来源，方便你排错
         if learned_px4_ip is None:
-            learned_px4_ip = src_ip
-            print(f"[FWD] first PX4-like packet from {learned_px4_ip}:{src_port}, start forwarding to controller")
+            learned_px4_ip = batch.src_ip(0)
+            print(f"[FWD] first PX4-like packet from {learned_px4_ip}, start forwarding to controller")
 
         if not CONTROLLER_IP:
             # 理论上不会发生，因为 main 里已经校验过
@@ -455,7 +852,7 @@ def px4_to_controller_forward_worker():
 
         try:
             # 无条件转发到控制端 14557
-            sock.sendto(data, (CONTROLLER_IP, CONTROLLER_PORT))
+            batch.send_to(sock, range(n), (CONTROLLER_IP, CONTROLLER_PORT))
         except Exception as e:
             print(f"[FWD] PX4 send error: {e}")
 
@@ -464,9 +861,16 @@ def px4_to_controller_forward_worker():
 
 @app.on_event("startup")
 async def on_startup():
-    global MAIN_LOOP
+    global MAIN_LOOP, BROADCAST_EVENT, _BROADCAST_TASK
     MAIN_LOOP = asyncio.get_running_loop()
 
+    # 广播队列的消费者
+    BROADCAST_EVENT = asyncio.Event()
+    _BROADCAST_TASK = asyncio.create_task(broadcast_drain_task())
+
+    if HOLD_CPU_DMA_LATENCY:
+        hold_cpu_dma_latency()
+
     # RAW 抓包线程（只解析控制器 -> PX4 控制流）
     t_raw = threading.Thread(target=raw_worker, args=(MAIN_LOOP,), daemon=True)
     t_raw.start()
@@ -520,11 +924,8 @@ async def ws_parse(ws: WebSocket):
     with LOCK:
         pkt = LAST_PACKET
     if pkt is not None:
-        await ws.send_text(
-            json.dumps(
-                {"type": "packet", "packet": pkt.to_dict()},
-                ensure_ascii=False,
-            )
+        await ws.send_bytes(
+            orjson.dumps({"type": "packet", "packet": pkt.to_dict()})
         )
 
     try:
@@ -0,0 +1,188 @@
+# backend/mmsg.py
+"""
+recvmmsg(2) / sendmmsg(2) 的 ctypes 封装：一次系统调用收发一批数据报 / 原始帧。
+缓冲区、iovec、mmsghdr 都在构造时分配好，循环里不再产生新的 C 结构。
+"""
+import ctypes
+import ctypes.util
+import os
+import socket
+import struct
+from typing import Dict, Optional, Sequence, Tuple
+
+MSG_WAITFORONE = 0x10000  # 第一个包之前阻塞，之后有多少收多少
+SO_TIMESTAMPNS = 35       # asm-generic/socket.h，同时也是 cmsg_type SCM_TIMESTAMPNS
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", _MsgHdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+_libc.recvmmsg.argtypes = [
+    ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p,
+]
+_libc.recvmmsg.restype = ctypes.c_int
+_libc.sendmmsg.argtypes = [
+    ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int,
+]
+_libc.sendmmsg.restype = ctypes.c_int
+
+_SOCKADDR_LEN = 128  # sizeof(struct sockaddr_storage)
+_SOCKADDR_IN = struct.Struct("=H2s4s8x")  # sin_family, sin_port(网络序), sin_addr
+
+_CMSG_SPACE = 64                   # 每个槽位的控制消息缓冲，放一个 timespec 足够
+_CMSGHDR = struct.Struct("@Nii")   # cmsg_len, cmsg_level, cmsg_type
+_TIMESPEC = struct.Struct("@ll")   # tv_sec, tv_nsec
+_CMSG_ALIGN = ctypes.sizeof(ctypes.c_size_t)
+
+
+def _check(ret: int) -> int:
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+class RecvBatch:
+    """
+    batch 个固定大小的接收槽：
+      n = rb.recv(sock)            # 一次 recvmmsg
+      rb.frame(i)                  # 第 i 个包（memoryview，下次 recv 前有效）
+      rb.src_ip(i)                 # 第 i 个包的来源 IP（with_addr=True 时）
+      rb.timestamp_ns(i)           # 第 i 个包的内核接收时间（with_timestamp=True 时）
+      rb.send_to(sock, idx, addr)  # 把 idx 里的这些包原样 sendmmsg 给 addr，不拷贝
+    超过 slot_size 的包会被截断。
+    """
+
+    def __init__(
+        self,
+        batch: int = 32,
+        slot_size: int = 2048,
+        with_addr: bool = False,
+        with_timestamp: bool = False,
+    ):
+        self.batch = batch
+        self.slot_size = slot_size
+        self.with_addr = with_addr
+        self.with_timestamp = with_timestamp
+
+        self._buf = bytearray(batch * slot_size)
+        mv = memoryview(self._buf)
+        self._slots = [mv[i * slot_size:(i + 1) * slot_size] for i in range(batch)]
+
+        base = ctypes.addressof((ctypes.c_char * len(self._buf)).from_buffer(self._buf))
+        self._iov = (_IOVec * batch)()
+        self._hdrs = (_MMsgHdr * batch)()
+        self._names = (ctypes.c_char * (_SOCKADDR_LEN * batch))() if with_addr else None
+        # 需要 socket 上先开 SO_TIMESTAMPNS，内核才会填 SCM_TIMESTAMPNS
+        self._ctrl = (ctypes.c_char * (_CMSG_SPACE * batch))() if with_timestamp else None
+        for i in range(batch):
+            self._iov[i].iov_base = base + i * slot_size
+            self._iov[i].iov_len = slot_size
+            hdr = self._hdrs[i].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self._iov[i])
+            hdr.msg_iovlen = 1
+            if with_addr:
+                hdr.msg_name = ctypes.addressof(self._names) + i * _SOCKADDR_LEN
+            if with_timestamp:
+                hdr.msg_control = ctypes.addressof(self._ctrl) + i * _CMSG_SPACE
+
+        # 发送侧：iovec 指回接收槽，长度按本次收到的 msg_len 填
+        self._send_iov = (_IOVec * batch)()
+        self._send_hdrs = (_MMsgHdr * batch)()
+        for i in range(batch):
+            hdr = self._send_hdrs[i].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self._send_iov[i])
+            hdr.msg_iovlen = 1
+        self._dst_cache: Dict[Tuple[str, int], ctypes.Array] = {}
+
+    def recv(self, sock: socket.socket, flags: int = MSG_WAITFORONE) -> int:
+        """收一批，返回本次收到的包数"""
+        if self.with_addr or self.with_timestamp:
+            # 内核会改写 msg_namelen / msg_controllen，每次收之前恢复
+            for i in range(self.batch):
+                hdr = self._hdrs[i].msg_hdr
+                if self.with_addr:
+                    hdr.msg_namelen = _SOCKADDR_LEN
+                if self.with_timestamp:
+                    hdr.msg_controllen = _CMSG_SPACE
+        return _check(_libc.recvmmsg(sock.fileno(), self._hdrs, self.batch, flags, None))
+
+    def frame(self, i: int) -> memoryview:
+        return self._slots[i][:self._hdrs[i].msg_len]
+
+    def src_ip(self, i: int) -> str:
+        """第 i 个包的来源 IPv4 地址"""
+        _family, _port, addr = _SOCKADDR_IN.unpack_from(self._names, i * _SOCKADDR_LEN)
+        return socket.inet_ntoa(addr)
+
+    def timestamp_ns(self, i: int) -> Optional[int]:
+        """第 i 个包的 SCM_TIMESTAMPNS（纳秒），没有就返回 None"""
+        base = i * _CMSG_SPACE
+        end = base + self._hdrs[i].msg_hdr.msg_controllen
+        off = base
+        while off + _CMSGHDR.size <= end:
+            cmsg_len, level, ctype = _CMSGHDR.unpack_from(self._ctrl, off)
+            if cmsg_len < _CMSGHDR.size:
+                break
+            if level == socket.SOL_SOCKET and ctype == SO_TIMESTAMPNS:
+                sec, nsec = _TIMESPEC.unpack_from(self._ctrl, off + _CMSGHDR.size)
+                return sec * 1_000_000_000 + nsec
+            off += (cmsg_len + _CMSG_ALIGN - 1) & ~(_CMSG_ALIGN - 1)
+        return None
+
+    def _sockaddr(self, addr: Tuple[str, int]) -> ctypes.Array:
+        sa = self._dst_cache.get(addr)
+        if sa is None:
+            ip, port = addr
+            sa = ctypes.create_string_buffer(
+                _SOCKADDR_IN.pack(socket.AF_INET, struct.pack("!H", port), socket.inet_aton(ip)),
+                _SOCKADDR_IN.size,
+            )
+            self._dst_cache[addr] = sa
+        return sa
+
+    def send_to(self, sock: socket.socket, indices: Sequence[int], addr: Tuple[str, int]) -> int:
+        """把 indices 对应的已接收包一次 sendmmsg 给 addr，返回发出的包数"""
+        count = len(indices)
+        if count == 0:
+            return 0
+
+        sa = self._sockaddr(addr)
+        sa_ptr = ctypes.addressof(sa)
+        for k, i in enumerate(indices):
+            self._send_iov[k].iov_base = self._iov[i].iov_base
+            self._send_iov[k].iov_len = self._hdrs[i].msg_len
+            hdr = self._send_hdrs[k].msg_hdr
+            hdr.msg_name = sa_ptr
+            hdr.msg_namelen = _SOCKADDR_IN.size
+
+        # sendmmsg 可能只发出一部分，剩下的接着发
+        sent = 0
+        fd = sock.fileno()
+        while sent < count:
+            sent += _check(_libc.sendmmsg(fd, ctypes.byref(self._send_hdrs[sent]), count - sent, 0))
+        return sent
@@ -2,7 +2,7 @@
 from typing import Optional
 
 from . import LinkLayer, NetworkLayer, ApplicationLayer, PacketResult
-from .mavlink_parser import looks_like_mavlink, parse_mavlink_payload
+from .mavlink_parser import mavlink_frame_fits, parse_mavlink_payload
 from .net_parser import parse_generic_payload
 
 
@@ -29,10 +29,15 @@ def dispatch_packet(
         dst_port=dst_port,
     )
 
-    # 应用层：先判断是不是 MAVLink
-    if looks_like_mavlink(data):
-        app: ApplicationLayer = parse_mavlink_payload(data)
-    else:
+    # 应用层：STX 查表 + 帧长检查通过才交给 parse_mavlink_payload，
+    # 解析失败（ValueError）就按普通 payload 处理
+    app: Optional[ApplicationLayer] = None
+    if mavlink_frame_fits(data):
+        try:
+            app = parse_mavlink_payload(data)
+        except ValueError:
+            app = None
+    if app is None:
         app = parse_generic_payload(data, transport_upper)
 
     return PacketResult(
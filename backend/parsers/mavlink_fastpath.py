@@ -0,0 +1,167 @@
+from typing import Optional, Tuple
+import math
+import struct
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:  # numba not installed: same code runs as plain Python
+    np = None
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+
+MAVLINK_MSG_ID_LOCAL_POSITION_NED = 32
+MAVLINK_MSG_ID_SET_POSITION_TARGET_LOCAL_NED = 84
+MAVLINK_MSG_ID_POSITION_TARGET_LOCAL_NED = 85
+
+# Payload offset of the x, y, z float32 triple for each message scan_pos
+# extracts a position from (all three start with time_boot_ms: uint32).
+# GLOBAL_POSITION_INT carries lat/lon/alt instead of local x/y/z, so it
+# never yields a position.
+POS_OFFSETS = {
+    MAVLINK_MSG_ID_LOCAL_POSITION_NED: 4,
+    MAVLINK_MSG_ID_SET_POSITION_TARGET_LOCAL_NED: 4,
+    MAVLINK_MSG_ID_POSITION_TARGET_LOCAL_NED: 4,
+}
+POS_UNPACK = struct.Struct("<fff")
+
+SCAN_INVALID = -1  # not a complete MAVLink frame, or CRC mismatch
+
+
+@njit(cache=True)
+def _crc_extra(msg_id):
+    """CRC_EXTRA seed for the whitelisted messages (0 = not whitelisted)"""
+    if msg_id == 32:
+        return 185
+    if msg_id == 84:
+        return 143
+    if msg_id == 85:
+        return 140
+    return 0
+
+
+@njit(cache=True)
+def _x25_accumulate(crc, b):
+    tmp = (b ^ (crc & 0xFF)) & 0xFF
+    tmp = (tmp ^ (tmp << 4)) & 0xFF
+    return ((crc >> 8) ^ (tmp << 8) ^ (tmp << 3) ^ (tmp >> 4)) & 0xFFFF
+
+
+@njit(cache=True)
+def _x25_buffer(buf, crc):
+    for i in range(len(buf)):
+        crc = _x25_accumulate(crc, int(buf[i]))
+    return crc
+
+
+@njit(cache=True)
+def _scan_frame(buf):
+    """Validate the frame at buf[0]; returns (msg_id, sysid, compid, payload_start, payload_len)"""
+    n = len(buf)
+    if n < 8:
+        return SCAN_INVALID, 0, 0, 0, 0
+
+    stx = buf[0]
+    plen = int(buf[1])
+    if stx == 0xFD:  # MAVLink v2
+        header_len = 10
+        if n < header_len:
+            return SCAN_INVALID, 0, 0, 0, 0
+        sysid = int(buf[5])
+        compid = int(buf[6])
+        msg_id = int(buf[7]) | (int(buf[8]) << 8) | (int(buf[9]) << 16)
+    elif stx == 0xFE:  # MAVLink v1
+        header_len = 6
+        sysid = int(buf[3])
+        compid = int(buf[4])
+        msg_id = int(buf[5])
+    else:
+        return SCAN_INVALID, 0, 0, 0, 0
+
+    crc_end = header_len + plen
+    if n < crc_end + 2:
+        return SCAN_INVALID, 0, 0, 0, 0
+
+    extra = _crc_extra(msg_id)
+    if extra == 0:
+        return msg_id, sysid, compid, header_len, plen
+
+    crc = 0xFFFF
+    for i in range(1, crc_end):
+        crc = _x25_accumulate(crc, int(buf[i]))
+    crc = _x25_accumulate(crc, extra)
+    if crc != (int(buf[crc_end]) | (int(buf[crc_end + 1]) << 8)):
+        return SCAN_INVALID, 0, 0, 0, 0
+
+    return msg_id, sysid, compid, header_len, plen
+
+
+def scan_pos(buf) -> Tuple[int, int, int, float, float, float]:
+    """Scan the MAVLink frame at the start of buf (v1/v2) without pymavlink.
+    Returns (msg_id, sysid, compid, x, y, z):
+      - msg_id == SCAN_INVALID: incomplete frame, unknown STX or bad CRC
+      - msg_id not in POS_OFFSETS: x/y/z are NaN (CRC not checked)
+    """
+    arr = np.frombuffer(buf, dtype=np.uint8) if np is not None else buf
+    msg_id, sysid, compid, start, plen = _scan_frame(arr)
+    msg_id = int(msg_id)
+
+    off = POS_OFFSETS.get(msg_id)
+    if off is None:
+        return msg_id, int(sysid), int(compid), math.nan, math.nan, math.nan
+
+    start = int(start) + off
+    if plen - off >= POS_UNPACK.size:
+        x, y, z = POS_UNPACK.unpack_from(buf, start)
+    else:
+        # MAVLink v2 strips trailing zero bytes from the payload
+        tail = bytes(buf[start:start + max(0, plen - off)])
+        x, y, z = POS_UNPACK.unpack(tail.ljust(POS_UNPACK.size, b"\x00"))
+    return msg_id, int(sysid), int(compid), x, y, z
+
+
+def warm_up() -> None:
+    """Compile _scan_frame for both read-only (bytes) and writable (bytearray,
+    mmap ring) buffers, so a calling thread doesn't pay for it on its first frame.
+    """
+    scan_pos(b"")
+    scan_pos(bytearray())
+
+
+def extract_position(buf) -> Optional[Tuple[int, int, Tuple[float, float, float]]]:
+    """(sysid, compid, (x, y, z)) of a position message, x/y/z rounded to 3 decimals, or None"""
+    msg_id, sysid, compid, x, y, z = scan_pos(buf)
+    if msg_id not in POS_OFFSETS:
+        return None
+    return sysid, compid, (round(x, 3), round(y, 3), round(z, 3))
+
+
+class X25CRC:
+    """Drop-in replacement for pymavlink's x25crc with the byte loop in _x25_buffer"""
+
+    def __init__(self, buf=None):
+        self.crc = 0xFFFF
+        if buf is not None:
+            self.accumulate(buf)
+
+    def accumulate(self, buf):
+        if isinstance(buf, str):
+            buf = buf.encode()
+        elif isinstance(buf, (list, tuple)):
+            buf = bytes(buf)
+        self.crc = _x25_buffer(np.frombuffer(buf, dtype=np.uint8), self.crc)
+
+
+def install_x25crc(dialect) -> bool:
+    """Swap dialect.x25crc for X25CRC when pymavlink fell back to its pure-Python
+    CRC (dialect.mcrf4xx is None, i.e. fastcrc missing) and numba is available.
+    Returns True if patched.
+    """
+    if np is None or getattr(dialect, "mcrf4xx", None) is not None:
+        return False
+    dialect.x25crc = X25CRC
+    return True
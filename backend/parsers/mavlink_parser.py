@@ -1,30 +1,41 @@
-from typing import Any, Dict, Tuple, Optional
-import io
+from typing import Any, Callable, Dict, Tuple, Optional
+from functools import lru_cache
 import struct
+import threading
 
 from pymavlink.dialects.v20 import common as mavlink2
 
 from . import ApplicationLayer
+from .mavlink_fastpath import install_x25crc
 
+# Move pymavlink's per-byte CRC loop out of the interpreter where possible
+install_x25crc(mavlink2)
 
-def looks_like_mavlink(data: bytes) -> bool:
-    """Check if bytes resemble a MAVLink frame (1 frame per UDP/TCP packet)"""
-    if len(data) < 6:
-        return False
 
-    stx = data[0]
-    if stx not in (0xFE, 0xFD):  # MAVLink v1/v2 start byte
-        return False
+# Header + checksum length indexed by STX byte; 0 = not a MAVLink start byte
+MAVLINK_STX_OVERHEAD = [0] * 256
+MAVLINK_STX_OVERHEAD[0xFE] = 6 + 2   # MAVLink v1
+MAVLINK_STX_OVERHEAD[0xFD] = 10 + 2  # MAVLink v2
 
-    payload_len = data[1]
-    min_len = 6 + payload_len + 2 if stx == 0xFE else 10 + payload_len + 2  # v1/v2 min length
-    return len(data) >= min_len
+_CRC16 = struct.Struct("<H")
+# v2 msgid is 24-bit little-endian at offset 7; read 4 bytes (the frame always has a
+# checksum after the header) and mask off the top byte
+_V2_MSGID = struct.Struct("<I")
+
+
+def mavlink_frame_fits(data: bytes) -> bool:
+    """True if data starts with a MAVLink STX and is long enough for the frame its len byte announces"""
+    if len(data) < 2:
+        return False
+    overhead = MAVLINK_STX_OVERHEAD[data[0]]
+    return overhead != 0 and len(data) >= overhead + data[1]
 
 
 def _parse_header(data: bytes) -> Tuple[Dict[str, Any], int, int]:
     """Parse MAVLink header (v1/v2)
     Returns: (header_dict, header_len, frame_len)
     frame_len: Full length of frame (including checksum and optional signature)
+    stx / checksum are plain ints; format them as hex where they are displayed.
     """
     if len(data) < 6:
         raise ValueError("Data too short for MAVLink header")
@@ -46,7 +57,7 @@ def _parse_header(data: bytes) -> Tuple[Dict[str, Any], int, int]:
         
         incompat_flags, compat_flags = data[2], data[3]
         seq, sysid, compid = data[4], data[5], data[6]
-        msgid = data[7] | (data[8] << 8) | (data[9] << 16)
+        msgid = _V2_MSGID.unpack_from(data, 7)[0] & 0xFFFFFF
     else:
         raise ValueError(f"Unknown MAVLink STX: {stx:#x}")
 
@@ -59,43 +70,94 @@ def _parse_header(data: bytes) -> Tuple[Dict[str, Any], int, int]:
         signature = data[checksum_end:checksum_end + 13].hex()
         frame_len += 13
 
-    checksum = struct.unpack("<H", data[header_len + payload_len:checksum_end])[0]
+    checksum = _CRC16.unpack_from(data, header_len + payload_len)[0]
 
     return {
         "version": version,
-        "stx": f"0x{stx:02x}",
+        "stx": stx,
         "len": payload_len,
         "seq": seq,
         "sysid": sysid,
         "compid": compid,
         "msgid": msgid,
-        "checksum": f"0x{checksum:04x}",
+        "checksum": checksum,
         "incompat_flags": incompat_flags,
         "compat_flags": compat_flags,
         "signature": signature,
     }, header_len, frame_len
 
 
+_tls = threading.local()
+
+
+def _get_parser() -> "mavlink2.MAVLink":
+    """Per-thread MAVLink parser, reset to an empty buffer before each frame.
+    pymavlink's parser keeps buf/expected_length between calls, so it must not
+    be shared across threads. robust_parsing stays off: a CRC failure on the
+    filtered stream should just drop the frame, not trigger a byte-by-byte rescan.
+    """
+    mav = getattr(_tls, "mav", None)
+    if mav is None:
+        mav = mavlink2.MAVLink(None)
+        mav.robust_parsing = False
+        _tls.mav = mav
+    mav.buf = bytearray()
+    mav.buf_index = 0
+    mav.expected_length = mavlink2.HEADER_LEN_V1 + 2
+    mav.have_prefix_error = False
+    return mav
+
+
+@lru_cache(maxsize=None)
+def _dict_extractor(msg_cls: type) -> Callable[[Any], Dict[str, Any]]:
+    """Build (once per message class) a function equivalent to msg.to_dict()
+    with the field list unrolled; only char fields keep the bytes -> str decode.
+    """
+    items = [f"'mavpackettype': {msg_cls.msgname!r}"]
+    for name, ftype in zip(msg_cls.fieldnames, msg_cls.fieldtypes):
+        if ftype == "char":
+            items.append(
+                f"{name!r}: (msg.{name}.decode(errors='backslashreplace').rstrip('\\x00')"
+                f" if msg.{name}.__class__ is bytes else msg.{name})"
+            )
+        else:
+            items.append(f"{name!r}: msg.{name}")
+    source = "def extract(msg):\n    return {" + ", ".join(items) + "}\n"
+    ns: Dict[str, Any] = {}
+    exec(source, {}, ns)
+    return ns["extract"]
+
+
+def _msg_to_dict(msg) -> Dict[str, Any]:
+    """msg.to_dict() without the per-field isinstance check"""
+    if msg.__class__ is mavlink2.MAVLink_bad_data or not msg.__class__.fieldnames:
+        return msg.to_dict()
+    return _dict_extractor(msg.__class__)(msg)
+
+
 def parse_mavlink_payload(data: bytes) -> ApplicationLayer:
     """Parse bytes as MAVLink frame (supports v1/v2)
     ApplicationLayer.fields structure:
     {
       "header": {...},  # Parsed header info
-      "payload": {...}  # Message fields from msg.to_dict()
+      "payload": {...}  # Message fields, same as msg.to_dict()
     }
     """
     header, header_len, frame_len = _parse_header(data)
-    frame_bytes = data[:frame_len]
-    payload_bytes = frame_bytes[header_len:header_len + header["len"]]
+    # Slice through a memoryview: no copies, and none at all in the usual
+    # one-frame-per-datagram case
+    mv = memoryview(data)
+    frame_mv = mv if frame_len == len(mv) else mv[:frame_len]
 
     # Parse frame with pymavlink
-    mav = mavlink2.MAVLink(io.BytesIO())
+    mav = _get_parser()
     msg = None
-    for b in frame_bytes:
-        parsed = mav.parse_char(bytes([b]))
-        if parsed:
-            msg = parsed
-            break
+    try:
+        # One pass over the whole frame; the parser was reset, so the first
+        # message returned is this frame's
+        msg = mav.parse_char(frame_mv)
+    except mavlink2.MAVError:
+        msg = None  # bad CRC / unknown message: reported below as _error
 
     msg_name: Optional[str] = None
     msg_id: Optional[int] = header["msgid"]
@@ -104,10 +166,10 @@ def parse_mavlink_payload(data: bytes) -> ApplicationLayer:
     if not msg:
         payload_fields = {
             "_error": "Unable to parse MAVLink message payload",
-            "_raw_payload_hex": payload_bytes.hex()
+            "_raw_payload_hex": mv[header_len:header_len + header["len"]].hex()
         }
     else:
-        payload_fields = msg.to_dict()
+        payload_fields = _msg_to_dict(msg)
         msg_name = msg.get_type()
         msg_id = msg.get_msgId()
         # Add extra metadata
@@ -124,5 +186,5 @@ def parse_mavlink_payload(data: bytes) -> ApplicationLayer:
         msg_name=msg_name,
         msg_id=msg_id,
         fields={"header": header, "payload": payload_fields},
-        raw_hex=frame_bytes.hex()  # Full frame hex (stx to signature)
+        raw_hex=frame_mv.hex()  # Full frame hex (stx to signature)
     )
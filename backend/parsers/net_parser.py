@@ -1,12 +1,27 @@
 # backend/parsers/net_parser.py
-from typing import Dict, Any
+from typing import Dict, Any, List
+import socket
+import struct
 
 from . import ApplicationLayer
 
+_ETH = struct.Struct("!6s6sH")
+_IPV4 = struct.Struct("!BBHHHBBH4s4s")
+_UDP = struct.Struct("!HHHH")
+_TCP = struct.Struct("!HHLLBBHHH")
+
+ETH_TYPE_IPV4 = 0x0800
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+
+
+# Printable ASCII maps to itself, everything else to '.'
+_ASCII_TABLE = bytes(b if 32 <= b <= 126 else 0x2E for b in range(256))
+
 
 def _ascii_preview(data: bytes, max_len: int = 32) -> str:
     """Convert first max_len bytes to ASCII (non-printable chars replaced with '.')"""
-    return ''.join(chr(b) if 32 <= b <= 126 else '.' for b in data[:max_len])
+    return bytes(data[:max_len]).translate(_ASCII_TABLE).decode('latin1')
 
 
 def parse_generic_payload(data: bytes, transport: str) -> ApplicationLayer:
@@ -29,3 +44,83 @@ def parse_generic_payload(data: bytes, transport: str) -> ApplicationLayer:
         fields=fields,
         raw_hex=data.hex(),
     )
+
+
+def parse_packet(raw_bytes: bytes) -> Dict[str, Any]:
+    """Decode Ethernet / IPv4 / TCP|UDP headers of a raw frame with struct
+    Returns:
+    {
+      "layers": [{"layer": "Ethernet", ...}, {"layer": "IPv4", ...}, ...],
+      "payload_raw_hex": "...",   # bytes after the last decoded header
+      "payload_as_text": "...",   # same bytes as UTF-8 (invalid bytes replaced)
+    }
+    Headers that are truncated or not recognised end decoding; the rest of
+    the frame is reported as payload.
+    """
+    layers: List[Dict[str, Any]] = []
+    offset = 0
+
+    if len(raw_bytes) >= _ETH.size:
+        dst_mac, src_mac, eth_type = _ETH.unpack_from(raw_bytes, 0)
+        layers.append({
+            "layer": "Ethernet",
+            "src_mac": src_mac.hex(":"),
+            "dst_mac": dst_mac.hex(":"),
+            "eth_type": f"0x{eth_type:04x}",
+        })
+        offset = _ETH.size
+
+        if eth_type == ETH_TYPE_IPV4 and len(raw_bytes) >= offset + _IPV4.size:
+            (ver_ihl, tos, total_len, ident, flags_frag,
+             ttl, proto, checksum, src_ip, dst_ip) = _IPV4.unpack_from(raw_bytes, offset)
+            ihl = (ver_ihl & 0x0F) * 4
+            layers.append({
+                "layer": "IPv4",
+                "version": ver_ihl >> 4,
+                "ihl": ihl,
+                "tos": tos,
+                "total_len": total_len,
+                "id": ident,
+                "flags": flags_frag >> 13,
+                "frag": flags_frag & 0x1FFF,
+                "ttl": ttl,
+                "proto": proto,
+                "checksum": f"0x{checksum:04x}",
+                "src_ip": socket.inet_ntoa(src_ip),
+                "dst_ip": socket.inet_ntoa(dst_ip),
+            })
+            offset += ihl
+
+            if proto == IP_PROTO_UDP and len(raw_bytes) >= offset + _UDP.size:
+                sport, dport, length, checksum = _UDP.unpack_from(raw_bytes, offset)
+                layers.append({
+                    "layer": "UDP",
+                    "sport": sport,
+                    "dport": dport,
+                    "len": length,
+                    "checksum": f"0x{checksum:04x}",
+                })
+                offset += _UDP.size
+            elif proto == IP_PROTO_TCP and len(raw_bytes) >= offset + _TCP.size:
+                (sport, dport, seq, ack, data_off,
+                 flags, window, checksum, urgptr) = _TCP.unpack_from(raw_bytes, offset)
+                layers.append({
+                    "layer": "TCP",
+                    "sport": sport,
+                    "dport": dport,
+                    "seq": seq,
+                    "ack": ack,
+                    "dataofs": data_off >> 4,
+                    "flags": f"0x{flags:02x}",
+                    "window": window,
+                    "checksum": f"0x{checksum:04x}",
+                    "urgptr": urgptr,
+                })
+                offset += (data_off >> 4) * 4
+
+    payload = raw_bytes[offset:]
+    return {
+        "layers": layers,
+        "payload_raw_hex": payload.hex(),
+        "payload_as_text": payload.decode("utf-8", errors="replace"),
+    }
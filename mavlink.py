@@ -1,11 +1,13 @@
 import socket
-import binascii
 from pymavlink.dialects.v20 import common as mavlink2
 
 # 必须和你的后端 UDP 监听一致
 UDP_HOST = "127.0.0.1"
 UDP_PORT = 9999
 
+# 多次调用共用一个发送套接字
+_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
 
 def build_local_position_ned_hex() -> str:
     """
@@ -53,15 +55,9 @@ def send_raw_hex(hex_str: str):
     """
     将十六进制字符串作为 UDP 载荷发送到后端 127.0.0.1:9999
     """
-    clean = "".join(hex_str.split())
-    if len(clean) % 2 != 0:
-        raise ValueError("十六进制长度必须为偶数！")
-
-    data = binascii.unhexlify(clean)
+    data = bytes.fromhex(hex_str)  # 自动跳过空白；长度为奇数 / 非法字符会抛 ValueError
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.sendto(data, (UDP_HOST, UDP_PORT))
-    sock.close()
+    _sock.sendto(data, (UDP_HOST, UDP_PORT))
 
     print(f"已发送 {len(data)} 字节 到 {UDP_HOST}:{UDP_PORT}")
 
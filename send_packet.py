@@ -1,23 +1,19 @@
 import socket
-import binascii
 
 UDP_HOST = "127.0.0.1"  # 必须和后端一致
 UDP_PORT = 9999         # 必须和后端一致
 
+# 多次调用共用一个发送套接字
+_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
 def send_raw_hex(hex_str: str):
     """
     hex_str: 纯十六进制字符串，可以包含空格换行
     示例:
         "01 02 03 04"
     """
-    clean = "".join(hex_str.split())
-    if len(clean) % 2 != 0:
-        raise ValueError("十六进制长度必须为偶数！")
-
-    data = binascii.unhexlify(clean)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.sendto(data, (UDP_HOST, UDP_PORT))
-    sock.close()
+    data = bytes.fromhex(hex_str)  # 自动跳过空白；长度为奇数 / 非法字符会抛 ValueError
+    _sock.sendto(data, (UDP_HOST, UDP_PORT))
     print(f"已发送 {len(data)} 字节 到 {UDP_HOST}:{UDP_PORT}")
 
 if __name__ == "__main__":